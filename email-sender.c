@@ -16,6 +16,10 @@
  *     --file body.html \
  *     --token "$(cat access_token.txt)"
  *
+ *   Use --file - to read the body from stdin.
+ *   If --token is omitted the token is taken from $OAUTH2_TOKEN, which keeps it
+ *   out of the process list (/proc/<pid>/cmdline, ps).
+ *
  * Defaults:
  *   Server: smtp.office365.com
  *   Port:   587 (STARTTLS)
@@ -31,6 +35,7 @@
 
 #define DEFAULT_SMTP_HOST "smtp.office365.com"
 #define DEFAULT_SMTP_PORT 587
+#define TOKEN_ENV_VAR     "OAUTH2_TOKEN"
 
 struct payload {
     const char *data;
@@ -60,7 +65,33 @@ static void rfc2822_date(char *buf, size_t buflen) {
     strftime(buf, buflen, "%a, %d %b %Y %H:%M:%S +0000", &tm);
 }
 
+// Read an entire stream of unknown length (e.g. stdin). Caller must free(*out).
+static int read_stream(FILE *f, char **out, size_t *out_len) {
+    size_t cap = 8192, n = 0, r;
+    char *buf = (char *)malloc(cap + 1);
+    if (!buf) return -1;
+
+    while ((r = fread(buf + n, 1, cap - n, f)) > 0) {
+        n += r;
+        if (n == cap) {
+            char *grown = (char *)realloc(buf, cap * 2 + 1);
+            if (!grown) { free(buf); return -1; }
+            buf = grown;
+            cap *= 2;
+        }
+    }
+    if (ferror(f)) { free(buf); return -1; }
+
+    buf[n] = '\0';
+    *out = buf;
+    *out_len = n;
+    return 0;
+}
+
+// "-" reads the body from stdin so callers can pipe it instead of writing a file.
 static int read_file(const char *path, char **out, size_t *out_len) {
+    if (strcmp(path, "-") == 0) return read_stream(stdin, out, out_len);
+
     FILE *f = fopen(path, "rb");
     if (!f) return -1;
     if (fseek(f, 0, SEEK_END) != 0) { fclose(f); return -1; }
@@ -201,10 +232,10 @@ static void usage(const char *prog) {
         "  -t, --to       Recipient email address (required)\n"
         "  -j, --subject  Email subject (default: \"No subject\")\n"
         "  -u, --username SMTP username (usually your full UPN)\n"
-        "  -T, --token    OAuth2 access token string (required)\n"
-        "  -F, --file     HTML body file (required)\n"
+        "  -T, --token    OAuth2 access token string (default: $%s)\n"
+        "  -F, --file     HTML body file, or - to read it from stdin (required)\n"
         "  -h, --help     Show this help\n",
-        prog, DEFAULT_SMTP_HOST, DEFAULT_SMTP_PORT);
+        prog, DEFAULT_SMTP_HOST, DEFAULT_SMTP_PORT, TOKEN_ENV_VAR);
 }
 
 int main(int argc, char **argv) {
@@ -246,6 +277,11 @@ int main(int argc, char **argv) {
         }
     }
 
+    if (!token) {
+        token = getenv(TOKEN_ENV_VAR);
+        if (token && !*token) token = NULL;
+    }
+
     if (!from_name || !from || !to || !username || !token || !filename) {
         usage(argv[0]);
         return 1;
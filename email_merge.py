@@ -1,51 +1,66 @@
-import json, time, random, subprocess
+import time, smtplib
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from email.message import EmailMessage
+from email.utils import formatdate
+
+from m365_smtp import SmtpConnectionPool, describe_error
+from rate_limit import TokenBucket
+from json_codec import to_json
 
 MAX_CONCURRENCY = 3            # threads in parallel (tune carefully)
 RATE_PER_MINUTE = 60           # hard cap across all threads
-SPACING = 60.0 / max(1, RATE_PER_MINUTE)
-
-def send_one(rec):
-    # light jitter to avoid thundering herd
-    time.sleep(random.uniform(0, SPACING))
-
-    # build your CLI invocation (example args)
-    cmd = [
-        "email-sender",                      # your email CLI
-        "--to", rec["email"],
-        "--subject", rec["subject"],
-        "--body", rec["body"],               # or --body-file path
-    ]
-
-    backoff = 1.0
-    for attempt in range(1, 6):  # up to 5 tries
-        t0 = time.time()
-        p = subprocess.run(cmd, capture_output=True, text=True)
-        dt = time.time() - t0
 
-        if p.returncode == 0:
+# shared by all worker threads so RATE_PER_MINUTE holds across the whole merge
+_bucket = TokenBucket(rate=RATE_PER_MINUTE / 60.0, burst=MAX_CONCURRENCY)
+
+# seconds to wait before each retry of a failed send; the shared bucket then spaces the retry
+_BACKOFFS = (1.0, 2.0, 4.0, 8.0)
+
+def send_one(smtp_pool, from_addr, rec):
+    msg = EmailMessage()
+    msg["Date"] = formatdate(usegmt=True)
+    msg["From"] = from_addr
+    msg["To"] = rec["email"]
+    msg["Subject"] = rec["subject"]
+    msg.set_content(rec["body"], subtype="html")
+
+    for attempt in range(len(_BACKOFFS) + 1):  # first try + one retry per backoff step
+        if attempt:
+            # transient? back off and retry
+            time.sleep(_BACKOFFS[attempt - 1])
+        # every attempt, retries included, waits for a slot under the global send rate
+        _bucket.acquire()
+        t0 = time.time()
+        try:
+            smtp_pool.send(msg)
+        except (smtplib.SMTPException, OSError) as e:
+            error = describe_error(e)
+        else:
+            dt = time.time() - t0
             return {"email": rec["email"], "ok": True, "ms": int(dt*1000)}
-        # transient? back off and retry
-        time.sleep(backoff + random.uniform(0, 0.200))
-        backoff = min(backoff * 2, 16.0)
 
     return {
         "email": rec["email"],
         "ok": False,
-        "error": (p.stderr or p.stdout).strip()[:2000]
+        "error": error[:2000]
     }
 
-def run_mail_merge(records):
+def run_mail_merge(records, username, access_token, from_addr, max_workers=MAX_CONCURRENCY):
+    # one authenticated connection per worker thread, reused for every send
+    smtp_pool = SmtpConnectionPool(username, access_token)
     results = []
-    with ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as pool:
-        futures = [pool.submit(send_one, r) for r in records]
-        for fut in as_completed(futures):
-            res = fut.result()
-            print(json.dumps(res, ensure_ascii=False))
-            results.append(res)
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(send_one, smtp_pool, from_addr, r) for r in records]
+            for fut in as_completed(futures):
+                res = fut.result()
+                print(to_json(res))
+                results.append(res)
+    finally:
+        smtp_pool.close_all()
     return results
 
 # Example usage:
 # records = [{"email":"a@x.com","subject":"Hi","body":"..."},
 #            {"email":"b@y.com","subject":"Hi","body":"..."}]
-# run_mail_merge(records)
+# run_mail_merge(records, "you@contoso.com", tok.access_token, "you@contoso.com")
@@ -0,0 +1,47 @@
+"""
+json_codec.py
+
+JSON encode/decode shared by the scripts in this repo. Uses orjson when it is
+installed and the stdlib json module otherwise. For the payloads written here
+(dicts of str, int, bool and None) the encoded text is the same either way, so
+logs and token files do not depend on which one ran. Floats are not covered:
+orjson writes 1e16 where json writes 1e+16, and NaN/Infinity as null.
+"""
+
+import json
+from typing import Any
+
+try:
+    import orjson  # optional; much faster than the stdlib json module
+except ImportError:
+    orjson = None
+
+# orjson.JSONDecodeError subclasses this, so one except clause covers both decoders
+JSONDecodeError = json.JSONDecodeError
+
+
+def to_json(obj: Any) -> str:
+    """Compact JSON with non-ASCII kept as-is."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def to_json_line(obj: Any) -> bytes:
+    """to_json() plus a trailing newline, as UTF-8 bytes: one NDJSON record, ready for a binary stream."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(obj, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def to_json_indented(obj: Any) -> str:
+    """Human-readable JSON, 2-space indent, non-ASCII kept as-is."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+    return json.dumps(obj, indent=2, ensure_ascii=False)
+
+
+def from_json(data: bytes | str) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
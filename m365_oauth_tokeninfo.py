@@ -1,8 +1,8 @@
-import json, dataclasses
+import json, dataclasses, time, threading
 from dataclasses import dataclass, fields
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any, Dict, Optional, List
+from typing import Any, Callable, ClassVar, Dict, FrozenSet, Optional, List
 
 @dataclass
 class OAuthToken:
@@ -14,6 +14,13 @@ class OAuthToken:
     obtained_at: int = 0
     ext_expires_in: Optional[int] = None
 
+    # Field names accepted by _coerce; filled in per class on first use
+    _ALLOWED: ClassVar[Optional[FrozenSet[str]]] = None
+
+    def __post_init__(self):
+        # Unix expiry computed once so expiry checks are plain int arithmetic
+        self._expires_at_unix = int(self.obtained_at) + int(self.expires_in)
+
     # -------- Convenience --------
     @property
     def scopes(self) -> List[str]:
@@ -21,11 +28,11 @@ class OAuthToken:
 
     @property
     def expires_at(self) -> datetime:
-        return datetime.fromtimestamp(self.obtained_at + self.expires_in, tz=timezone.utc)
+        return datetime.fromtimestamp(self._expires_at_unix, tz=timezone.utc)
 
     @property
     def seconds_until_expiry(self) -> int:
-        return max(0, int((self.expires_at - datetime.now(timezone.utc)).total_seconds()))
+        return max(0, self._expires_at_unix - int(time.time()))
 
     def needs_refresh(self, skew_seconds: int = 120) -> bool:
         """True if expired or will expire within skew_seconds."""
@@ -39,7 +46,10 @@ class OAuthToken:
     # -------- Parsing helpers --------
     @classmethod
     def _coerce(cls, data: Dict[str, Any]) -> Dict[str, Any]:
-        allowed = {f.name for f in fields(cls)}
+        allowed = cls.__dict__.get("_ALLOWED")
+        if allowed is None:
+            # Looked up on cls.__dict__ so a subclass with extra fields gets its own set
+            allowed = cls._ALLOWED = frozenset(f.name for f in fields(cls))
         payload = {k: v for k, v in data.items() if k in allowed}
         # Normalize possibly-string numbers
         for k in ("expires_in", "obtained_at", "ext_expires_in"):
@@ -47,6 +57,10 @@ class OAuthToken:
                 payload[k] = int(payload[k])
         return payload
 
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "OAuthToken":
+        return cls(**cls._coerce(data))
+
     @classmethod
     def from_json(cls, s: str) -> "OAuthToken":
         return cls(**cls._coerce(json.loads(s)))
@@ -55,3 +69,47 @@ class OAuthToken:
     def from_file(cls, path: str | Path) -> "OAuthToken":
         with open(path, "r", encoding="utf-8") as f:
             return cls(**cls._coerce(json.load(f)))
+
+
+class TokenRefreshError(RuntimeError):
+    """The refresh callback failed; the cached token can no longer be renewed."""
+
+
+class TokenCache:
+    """
+    Thread-safe holder for the current OAuthToken. If a `refresh` callable is
+    given, get_access_token() swaps in a new token once the current one is
+    within `skew_seconds` of expiring, so long-running senders never use a
+    stale bearer token. If a refresh fails, that and every later call raises
+    TokenRefreshError without retrying the token endpoint.
+    """
+
+    def __init__(self, token: OAuthToken,
+                 refresh: Optional[Callable[[OAuthToken], OAuthToken]] = None,
+                 skew_seconds: int = 300):
+        self._token = token
+        self._refresh = refresh
+        self._skew = skew_seconds
+        self._lock = threading.Lock()
+        self._error: Optional[str] = None
+
+    @property
+    def token(self) -> OAuthToken:
+        return self._token
+
+    def get_access_token(self) -> str:
+        tok = self._token
+        if self._refresh is None or not tok.needs_refresh(self._skew):
+            return tok.access_token
+        with self._lock:
+            if self._error is not None:
+                raise TokenRefreshError(self._error)
+            # Another thread may have refreshed while we waited for the lock
+            if self._token.needs_refresh(self._skew):
+                try:
+                    self._token = self._refresh(self._token)
+                except Exception as e:
+                    # Wrapped so callers that catch OSError (requests errors included) don't retry it as a send failure
+                    self._error = str(e) or type(e).__name__
+                    raise TokenRefreshError(self._error) from e
+            return self._token.access_token
@@ -0,0 +1,137 @@
+"""
+m365_smtp.py
+
+Send mail through Microsoft 365 SMTP (STARTTLS + XOAUTH2) from inside the Python
+process, keeping one authenticated connection per worker thread so a mail merge
+does not pay a fork/exec, TCP connect, TLS handshake and AUTH for every message.
+"""
+
+import smtplib
+import threading
+import time
+from email.message import EmailMessage
+from typing import Callable, List, Optional, Union
+
+DEFAULT_SMTP_HOST = "smtp.office365.com"
+DEFAULT_SMTP_PORT = 587   # STARTTLS, same as the C sender
+
+# Connections idle for longer than this get a NOOP before reuse
+IDLE_CHECK_SECONDS = 30.0
+
+
+def build_xoauth2(username: str, access_token: str) -> str:
+    """SASL XOAUTH2 initial response (smtplib base64-encodes it)."""
+    return f"user={username}\x01auth=Bearer {access_token}\x01\x01"
+
+
+def describe_error(exc: BaseException) -> str:
+    """
+    Render a send failure in the same shape as the libcurl transcript the C sender
+    prints ('< ' server reply, '* ' status line), so parse_smtp_failures.py can
+    summarize failures from either sender.
+    """
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return "\n".join(
+            f"< {code} {msg.decode('utf-8', 'replace') if isinstance(msg, bytes) else msg}"
+            for code, msg in exc.recipients.values()
+        )
+    if isinstance(exc, smtplib.SMTPResponseException):
+        msg = exc.smtp_error
+        if isinstance(msg, bytes):
+            msg = msg.decode("utf-8", "replace")
+        return f"< {exc.smtp_code} {msg}"
+    return f"* {type(exc).__name__}: {exc}"
+
+
+class SmtpConnectionPool:
+    """
+    Lazily opens one authenticated SMTP connection per thread and reuses it.
+    A connection the server has dropped is discarded and re-opened once.
+    """
+
+    def __init__(self, username: str, access_token: Union[str, Callable[[], str]],
+                 host: str = DEFAULT_SMTP_HOST, port: int = DEFAULT_SMTP_PORT,
+                 timeout: float = 60.0):
+        self.username = username
+        # A callable (e.g. TokenCache.get_access_token) is asked for a fresh token on each connect
+        self._get_token = access_token if callable(access_token) else (lambda: access_token)
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._open: List[smtplib.SMTP] = []
+
+    def _connect(self) -> smtplib.SMTP:
+        xoauth2 = build_xoauth2(self.username, self._get_token())
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            smtp.ehlo()
+            smtp.starttls()
+            smtp.ehlo()
+            # On failure the server sends a 334 JSON challenge and expects an empty reply
+            smtp.auth(
+                "XOAUTH2",
+                lambda challenge=None: xoauth2 if challenge is None else "",
+            )
+        except BaseException:
+            smtp.close()
+            raise
+        with self._lock:
+            self._open.append(smtp)
+        return smtp
+
+    def _discard(self) -> None:
+        smtp: Optional[smtplib.SMTP] = getattr(self._local, "smtp", None)
+        self._local.smtp = None
+        if smtp is None:
+            return
+        with self._lock:
+            if smtp in self._open:
+                self._open.remove(smtp)
+        try:
+            smtp.close()
+        except OSError:
+            pass
+
+    def connection(self) -> smtplib.SMTP:
+        smtp: Optional[smtplib.SMTP] = getattr(self._local, "smtp", None)
+        if smtp is not None and time.monotonic() - self._local.last_used > IDLE_CHECK_SECONDS:
+            try:
+                smtp.noop()
+            except (smtplib.SMTPServerDisconnected, OSError):
+                self._discard()
+                smtp = None
+        if smtp is None:
+            smtp = self._connect()
+            self._local.smtp = smtp
+        self._local.last_used = time.monotonic()
+        return smtp
+
+    def send(self, msg: EmailMessage) -> None:
+        try:
+            self.connection().send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            # Server closed an idle/old connection; reconnect and try once more
+            self._discard()
+            self.connection().send_message(msg)
+        except smtplib.SMTPResponseException as e:
+            # 421: service closing the channel; the connection is no longer usable
+            if e.smtp_code == 421:
+                self._discard()
+            raise
+        except smtplib.SMTPException:
+            # Refused recipients etc.: smtplib has already sent RSET, the connection is still good
+            raise
+        except OSError:  # must follow SMTPException, which subclasses it
+            self._discard()
+            raise
+
+    def close_all(self) -> None:
+        with self._lock:
+            conns, self._open = self._open, []
+        for smtp in conns:
+            try:
+                smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                smtp.close()
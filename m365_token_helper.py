@@ -23,24 +23,32 @@ Typical usage:
       --in tokens.json \
       --out tokens.json
 
-The resulting access_token can be passed to your C program with --token.
+The resulting access_token can be passed to your C program with --token, or (preferably, so it
+stays out of the process list) exported as OAUTH2_TOKEN.
 """
 
 import argparse
-import json
 import sys
 import time
 from pathlib import Path
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from json_codec import from_json, to_json_indented
 
 DEVICE_CODE_URL_TMPL = "https://login.microsoftonline.com/{tenant}/oauth2/v2.0/devicecode"
 TOKEN_URL_TMPL       = "https://login.microsoftonline.com/{tenant}/oauth2/v2.0/token"
 
 DEFAULT_SCOPES = "https://outlook.office365.com/SMTP.Send offline_access"
 
+# One keep-alive session for all token endpoint calls (the device-code poll loop
+# hits the same host every few seconds)
+_session = requests.Session()
+_session.mount("https://login.microsoftonline.com", HTTPAdapter(pool_connections=2, pool_maxsize=4))
 
-def save_tokens(path: Path, data: dict) -> None:
+
+def write_tokens(path: Path, data: dict) -> None:
     # Only store what's useful
     keep = {
         "access_token": data.get("access_token"),
@@ -51,12 +59,16 @@ def save_tokens(path: Path, data: dict) -> None:
         "scope": data.get("scope"),
         "obtained_at": int(time.time()),
     }
-    path.write_text(json.dumps(keep, indent=2))
+    path.write_text(to_json_indented(keep), encoding="utf-8")
+
+
+def save_tokens(path: Path, data: dict) -> None:
+    write_tokens(path, data)
     print(f"Saved tokens to {path}")
 
 
 def read_tokens(path: Path) -> dict:
-    return json.loads(path.read_text())
+    return from_json(path.read_bytes())
 
 
 def pretty_expiry(obtained_at: int, expires_in: int) -> str:
@@ -66,6 +78,25 @@ def pretty_expiry(obtained_at: int, expires_in: int) -> str:
     return f"{ttl} seconds remaining" if ttl > 0 else f"expired {-ttl} seconds ago"
 
 
+def refresh_tokens(tenant: str, client_id: str, refresh_token: str) -> dict:
+    """
+    Redeem a refresh_token for a new access token. Returns the token endpoint's
+    JSON response; raises RuntimeError if the request is rejected.
+    """
+    resp = _session.post(
+        TOKEN_URL_TMPL.format(tenant=tenant),
+        data={
+            "grant_type": "refresh_token",
+            "client_id": client_id,
+            "refresh_token": refresh_token,
+        },
+        timeout=30,
+    )
+    if resp.status_code != 200:
+        raise RuntimeError(f"Refresh failed: {resp.status_code} {resp.text}")
+    return resp.json()
+
+
 def cmd_login(args):
     tenant = args.tenant
     client_id = args.client_id
@@ -76,7 +107,7 @@ def cmd_login(args):
     token_url  = TOKEN_URL_TMPL.format(tenant=tenant)
 
     # 1) Start device code flow
-    resp = requests.post(
+    resp = _session.post(
         device_url,
         data={"client_id": client_id, "scope": scopes},
         timeout=30,
@@ -100,7 +131,7 @@ def cmd_login(args):
     start = time.time()
     while True:
         time.sleep(interval)
-        resp = requests.post(
+        resp = _session.post(
             token_url,
             data={
                 "grant_type": "urn:ietf:params:oauth:grant-type:device_code",
@@ -139,28 +170,18 @@ def cmd_refresh(args):
     in_path = Path(args.infile)
     out_path = Path(args.out)
 
-    token_url = TOKEN_URL_TMPL.format(tenant=tenant)
-
     current = read_tokens(in_path)
     refresh_token = current.get("refresh_token")
     if not refresh_token:
         print("No refresh_token found in input file. Run 'login' first.", file=sys.stderr)
         sys.exit(1)
 
-    resp = requests.post(
-        token_url,
-        data={
-            "grant_type": "refresh_token",
-            "client_id": client_id,
-            "refresh_token": refresh_token,
-        },
-        timeout=30,
-    )
-    if resp.status_code != 200:
-        print("Refresh failed:", resp.status_code, resp.text, file=sys.stderr)
+    try:
+        tokens = refresh_tokens(tenant, client_id, refresh_token)
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
         sys.exit(1)
 
-    tokens = resp.json()
     save_tokens(out_path, tokens)
     print("\nRefreshed access token.")
     print(f"Access token TTL: {tokens.get('expires_in')} seconds")
@@ -170,7 +191,7 @@ def cmd_show(args):
     data = read_tokens(Path(args.infile))
     obtained_at = data.get("obtained_at")
     expires_in = data.get("expires_in")
-    print(json.dumps(data, indent=2))
+    print(to_json_indented(data))
     print(f"\nStatus: {pretty_expiry(obtained_at, expires_in)}")
 
 
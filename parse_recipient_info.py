@@ -10,25 +10,36 @@ This script parses the input and emits values appropriate for consumption by the
 
 import argparse
 import csv
-import json
 import os
 import sys
 import logging
-from typing import List, Dict, Any, Optional, Union
-from logging.handlers import TimedRotatingFileHandler
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Union
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
+import queue
 from datetime import datetime, timezone, timedelta
 
 from typing import TypedDict, Literal, Union
 
-import json, time, random, subprocess
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import time, subprocess
+import smtplib
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import itertools
+import operator
+from collections import namedtuple
+import atexit
+import threading
 
-from m365_oauth_tokeninfo import OAuthToken
+from m365_oauth_tokeninfo import OAuthToken, TokenCache, TokenRefreshError
+from m365_smtp import SmtpConnectionPool, describe_error
+from rate_limit import TokenBucket
+from json_codec import to_json, from_json
 
 from pathlib import Path
 from jinja2 import Environment, FileSystemLoader, StrictUndefined, select_autoescape
 
-import tempfile
+import functools
+from email.message import EmailMessage
+from email.utils import formataddr, formatdate
 
 # logging.basicConfig(
 #     level=logging.INFO,
@@ -39,6 +50,9 @@ import tempfile
 # log = logging.getLogger("email-sender")
 
 
+_log_listener: Optional[QueueListener] = None
+
+
 def setup_logging(
     log_dir: str | Path = "logs",
     app_name: str = "email-sender",
@@ -47,7 +61,7 @@ def setup_logging(
     keep: int = 14,   # how many days of logs to keep when rotating
 ):
     """
-    Configure root logger to write to console and a date-stamped file.
+    Configure root logger to write to console (ERROR and above on stderr) and a date-stamped file.
     If rotate_daily=True, you'll get a new file each midnight with a YYYY-MM-DD suffix.
     If rotate_daily=False, you'll get a single file stamped with today's date when the program starts.
     """
@@ -64,11 +78,15 @@ def setup_logging(
     # Prevent duplicate handlers on repeated setup calls
     root.handlers.clear()
 
-    # --- Console handler ---
+    # --- Console handlers: progress to stdout, errors to stderr ---
     ch = logging.StreamHandler(stream=sys.stdout)
     ch.setLevel(level)
+    ch.addFilter(lambda record: record.levelno < logging.ERROR)
     ch.setFormatter(formatter)
-    root.addHandler(ch)
+
+    eh = logging.StreamHandler(stream=sys.stderr)
+    eh.setLevel(max(level, logging.ERROR))
+    eh.setFormatter(formatter)
 
     # --- File handler ---
     if rotate_daily:
@@ -89,12 +107,23 @@ def setup_logging(
 
     fh.setLevel(level)
     fh.setFormatter(formatter)
-    root.addHandler(fh)
+
+    # Sender threads only enqueue records; one listener thread formats them and
+    # does the console/file writes, so workers never contend for handler locks.
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    root.addHandler(QueueHandler(log_queue))
+    _log_listener = QueueListener(log_queue, ch, eh, fh, respect_handler_level=True)
+    _log_listener.start()
 
     return root  # optional, in case you want to inspect or add more handlers
 
 
 log = setup_logging(log_dir="logs", app_name="email-sender", level=logging.DEBUG, rotate_daily=True)
+# Flush whatever is still queued when the script exits
+atexit.register(lambda: _log_listener and _log_listener.stop())
 
 
 TEMPLATE_DIR = Path(".")
@@ -104,45 +133,116 @@ env = Environment(
     undefined=StrictUndefined,  # fail fast on missing keys
     trim_blocks=True,
     lstrip_blocks=True,
+    auto_reload=False,   # templates don't change mid-run; skip the per-lookup mtime check
+    cache_size=-1,
 )
 
 
-def render_email(template_base: str, context: dict) -> str:
-    body_tpl = env.get_template(f"{template_base}")
-    html = body_tpl.render(**context)
-    return html
+# Spreadsheet columns every recipient row must have, in Recipient field order
+_RECIPIENT_COLUMNS = ("title", "firstname", "lastname", "entitynamelong", "address", "EmailsToUse")
+
+# One recipient row, reduced to the columns the merge uses
+Recipient = namedtuple("Recipient", ["title", "firstname", "lastname", "country", "address", "email"])
+
+
+def _to_recipients(headers: List[str], rows_iter: Iterable[Any]) -> Iterator[Recipient]:
+    """
+    Resolve each Recipient column's position from the header once, then build every
+    row positionally with a C-level itemgetter instead of a per-row dict.
+    Raises ValueError before the first row if a required column is missing.
+    """
+    pos = {h: i for i, h in enumerate(headers)}  # duplicate headers: last one wins, as with dict(zip())
+    missing = [c for c in _RECIPIENT_COLUMNS if c not in pos]
+    if missing:
+        raise ValueError(f"missing required column(s): {', '.join(missing)}")
+
+    get = [pos[c] for c in _RECIPIENT_COLUMNS]
+    getter = operator.itemgetter(*get)
+    need = max(get) + 1
+    for row in rows_iter:
+        if len(row) < need:
+            row = (*row, *("",) * (need - len(row)))  # short row: trailing cells are empty
+        yield Recipient._make(getter(row))
 
 
 # -------- CSV --------
-def read_csv_to_rows(path: str) -> List[Dict[str, Any]]:
+def iter_csv_rows(path: str) -> Iterator[Recipient]:
+    # Plain csv.reader with positional access; rows are streamed, not collected.
     with open(path, "r", newline="", encoding="utf-8-sig") as f:
-        reader = csv.DictReader(f)
-        return [dict(row) for row in reader]
+        reader = csv.reader(f)
+        try:
+            headers = next(reader)
+        except StopIteration:
+            return
+
+        # Blank lines come back as [] (DictReader skipped these too)
+        yield from _to_recipients(headers, (row for row in reader if row))
 
 # -------- Excel (.xlsx / .xlsm) --------
-def read_excel_to_rows(path: str, sheet: Optional[str] = None) -> List[Dict[str, Any]]:
+def _bind_header(rows_iter: Iterator[Any]) -> Iterator[Recipient]:
+    """First row is the header; every following row becomes a Recipient."""
+    try:
+        headers = next(rows_iter)
+    except StopIteration:
+        return
+
+    headers = [str(h) if h is not None else "" for h in headers]
+    # Skip empty rows, e.g. formatted-but-blank rows past the end of the data
+    yield from _to_recipients(headers, (row for row in rows_iter if any(row)))
+
+def iter_excel_rows(path: str, sheet: Optional[str] = None) -> Iterator[Recipient]:
+    # python-calamine (Rust) parses xlsx many times faster than openpyxl; use it when installed
+    try:
+        from python_calamine import CalamineWorkbook  # type: ignore
+    except ImportError:
+        yield from _iter_excel_rows_openpyxl(path, sheet)
+        return
+
+    wb = CalamineWorkbook.from_path(path)
+    try:
+        ws = wb.get_sheet_by_name(sheet) if sheet else wb.get_sheet_by_index(0)
+
+        # iter_rows() streams (python-calamine >= 0.2); older releases only offer to_python()
+        rows_iter = iter(ws.iter_rows() if hasattr(ws, "iter_rows") else ws.to_python())
+        yield from _bind_header(map(_calamine_ints, rows_iter))
+    finally:
+        # close() arrived in python-calamine 0.3; older releases release the file on GC
+        if hasattr(wb, "close"):
+            wb.close()
+
+def _calamine_ints(row: List[Any]) -> List[Any]:
+    """
+    calamine returns every numeric cell as a float; give whole numbers back as int,
+    as openpyxl does, so a postcode 75001 is not rendered as "75001.0".
+    """
+    return [int(v) if type(v) is float and v.is_integer() else v for v in row]
+
+def _iter_excel_rows_openpyxl(path: str, sheet: Optional[str] = None) -> Iterator[Recipient]:
     try:
         from openpyxl import load_workbook  # type: ignore
     except Exception as e:
         raise RuntimeError(
-            "Reading Excel files requires the 'openpyxl' package. Install with: pip install openpyxl"
+            "Reading Excel files requires the 'python-calamine' or 'openpyxl' package. Install with: pip install python-calamine"
         ) from e
 
     wb = load_workbook(path, data_only=True, read_only=True)
-    ws = wb[sheet] if sheet else wb.active
-
-    rows_iter = ws.iter_rows(values_only=True)
     try:
-        headers = next(rows_iter)
-    except StopIteration:
-        return []
-
-    headers = [str(h) if h is not None else "" for h in headers]
-    out: List[Dict[str, Any]] = []
-    for row in rows_iter:
-        record = {headers[i]: row[i] if i < len(row) else None for i in range(len(headers))}
-        out.append(record)
-    return out
+        ws = wb[sheet] if sheet else wb.active
+
+        # read_only mode trusts the sheet's stored dimension. Some writers store a
+        # bogus "A1:A1" (or none at all), which would hide every row but the first;
+        # drop it so openpyxl scans the real extent instead.
+        try:
+            dim = ws.calculate_dimension()
+        except ValueError:  # unsized worksheet
+            dim = None
+        if dim in (None, "A1:A1", "A1"):
+            ws.reset_dimensions()
+
+        rows_iter = ws.iter_rows(values_only=True)
+        yield from _bind_header(rows_iter)
+    finally:
+        wb.close()  # read_only workbooks keep the file open until closed
 
 def to_keyed_dict(rows: List[Dict[str, Any]], key_column: str) -> Dict[str, Dict[str, Any]]:
     mapping: Dict[str, Dict[str, Any]] = {}
@@ -176,13 +276,36 @@ def token_expired(token: Dict, skew_seconds: int = 600) -> bool:
 
 
 
+def make_token_refresher(tenant: str, client_id: str, tokenfile: str):
+    """
+    Build a TokenCache refresh callback that redeems the refresh_token and writes
+    the new tokens back to `tokenfile`, so a merge outliving its access token keeps going.
+    """
+    from m365_token_helper import refresh_tokens, write_tokens
+
+    def refresh(tok: OAuthToken) -> OAuthToken:
+        log.info("OAuth bearer token is about to expire; refreshing it.")
+        data = refresh_tokens(tenant, client_id, tok.refresh_token)
+        if not data.get("refresh_token"):
+            data["refresh_token"] = tok.refresh_token
+        write_tokens(Path(tokenfile), data)
+        log.info(f"Saved refreshed tokens to {tokenfile}")
+        data["obtained_at"] = int(time.time())
+        return OAuthToken.from_dict(data)
+
+    return refresh
+
+
+
+# Any remaining line break (CR or LF) becomes one <br>, in a single translate pass
+_BR_TABLE = str.maketrans({"\r": "<br>", "\n": "<br>"})
+
 def format_address_html(address: str) -> str:
     return (
         address
         .replace("_x000D_", "")      # remove artifacts
-        .replace("\r\n", "\n")       # normalize CRLF
-        .replace("\r", "\n")
-        .replace("\n", "<br>")
+        .replace("\r\n", "\n")       # normalize CRLF so it yields a single <br>
+        .translate(_BR_TABLE)
     )
 
 
@@ -191,7 +314,12 @@ def format_address_html(address: str) -> str:
 
 MAX_CONCURRENCY = 12            # threads in parallel (tune carefully)
 RATE_PER_MINUTE = 600           # hard cap across all threads
-SPACING = 60.0 / max(1, RATE_PER_MINUTE)
+
+# shared by all worker threads so RATE_PER_MINUTE holds across the whole merge
+_bucket = TokenBucket(rate=RATE_PER_MINUTE / 60.0, burst=MAX_CONCURRENCY)
+
+# seconds to wait before each retry of a failed send; the shared bucket then spaces the retry
+_BACKOFFS = (1.0, 2.0, 4.0, 8.0)
 
 
 class SendSuccess(TypedDict):
@@ -214,92 +342,200 @@ SendResult = Union[SendSuccess, SendError]
 
 
 
-def send_one( test_mode:bool, tokenstr: str, acct_username: str, fromname:str, fromaddr: str, subject: str, templateemailhtmlpath: str, rec: Dict ) -> SendResult:
-    # light jitter to avoid thundering herd
-    time.sleep(random.uniform(0, SPACING))
+def deliver_smtp(smtp_pool: SmtpConnectionPool, from_header: str, subject: str, toAddr: str, html: str) -> Optional[str]:
+    """Send in-process over the calling thread's pooled connection. Returns None on success, else the error text."""
+    msg = EmailMessage()
+    msg["Date"] = formatdate(usegmt=True)
+    msg["From"] = from_header
+    msg["To"] = toAddr
+    msg["Subject"] = subject
+    msg.set_content(html, subtype="html")
 
-    address = rec.get("address", "")
-    if address is not None:
-        address = format_address_html( address )
+    try:
+        smtp_pool.send(msg)
+    except (smtplib.SMTPException, OSError) as e:
+        return describe_error(e)
+    return None
 
-    # Build context from your row fields
-    ctx = {
-        "title": rec.get("title", ""),
-        "firstname": rec.get("firstname", ""),
-        "lastname":  rec.get("lastname", ""),
-        "country":  rec.get("entitynamelong", ""),
-        "address":  address,
-    }
 
-    html = render_email(templateemailhtmlpath, ctx)
+def deliver_cli(base_cmd: tuple, get_token, toAddr: str, html: str) -> Optional[str]:
+    """
+    Send by running build/email-sender. `base_cmd` holds the arguments that are the
+    same for every recipient. Returns None on success, else the libcurl transcript.
+    """
+    # Body goes over stdin (--file -): no temp file to write, leave behind, or re-read
+    cmd = [*base_cmd, "--to", toAddr, "--file", "-"]
+    # Token goes in the environment, not argv, so it never shows up in ps / /proc/<pid>/cmdline
+    env = {**os.environ, "OAUTH2_TOKEN": get_token()}
 
-    # Write body to a temp file (unique per thread/recipient)
-    with tempfile.NamedTemporaryFile("w", delete=False, suffix=".html") as tmp:
-        tmp.write(html)
-        html_path = tmp.name
+    # Success is decided by the exit status alone; only stderr (the libcurl transcript) is kept
+    p = subprocess.run(cmd, input=html.encode("utf-8"), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if p.returncode == 0:
+        return None
+    return p.stderr.decode("utf-8", "replace").strip() or f"email-sender exited with status {p.returncode}"
+
+
+def send_one( test_mode:bool, limiter: TokenBucket, deliver, render, rec: Recipient ) -> SendResult:
+    address = rec.address
+    if address is not None:
+        address = format_address_html( address )
+
+    # Fill the template (compiled once per merge) from your row fields
+    html = render(
+        title=rec.title,
+        firstname=rec.firstname,
+        lastname=rec.lastname,
+        country=rec.country,
+        address=address,
+    )
 
 
     if test_mode is False:
-        toAddr = rec.get("EmailsToUse", "")
+        toAddr = rec.email
     else:
         toAddr = "mikecress+wafuniftest@gmail.com"
         # toAddr = "bucurlili13+wafuniftest@gmail.com"
         # toAddr = "wafunif@wafunif.org"
 
         
-    log.info( f"Sending e-mail to: {rec['title']} {rec['firstname']} {rec['lastname']} to {toAddr}" )
-
-    cmd = [
-        "build/email-sender",
-        "--from_name", fromname,
-        "--from", fromaddr,
-        "--to", toAddr,
-        "--subject", subject,
-        "--username", acct_username,
-        "--file", html_path,
-        "--token", tokenstr
-    ]
-
-    backoff = 1.0
-    for attempt in range(1, 6):  # up to 5 tries
+    log.info( f"Sending e-mail to: {rec.title} {rec.firstname} {rec.lastname} to {toAddr}" )
+
+    for attempt in range(len(_BACKOFFS) + 1):  # first try + one retry per backoff step
+        if attempt:
+            # transient? back off and retry
+            time.sleep(_BACKOFFS[attempt - 1])
+        # every attempt, retries included, counts against the send rate
+        limiter.acquire()
         t0 = time.time()
-        p = subprocess.run(cmd, capture_output=True, text=True)
+        error = deliver(toAddr, html)
         dt = time.time() - t0
 
-        if p.returncode == 0:
-            return {"email": toAddr, "firstname": rec['firstname'], "lastname": rec['lastname'], "country": rec["entitynamelong"], "ok": True, "ms": int(dt*1000)}
-        # transient? back off and retry
-        time.sleep(backoff + random.uniform(0, 0.200))
-        backoff = min(backoff * 2, 16.0)
+        if error is None:
+            return {"email": toAddr, "firstname": rec.firstname, "lastname": rec.lastname, "country": rec.country, "ok": True, "ms": int(dt*1000)}
 
     return {
         "email": toAddr,
-        "firstname": rec['firstname'],
-        "lastname": rec['lastname'],
-        "country": rec["entitynamelong"],
+        "firstname": rec.firstname,
+        "lastname": rec.lastname,
+        "country": rec.country,
         "ok": False,
-        "error": (p.stderr or p.stdout).strip()[:2000]
+        "error": error[:2000]
     }
 
 
-def run_mail_merge( test_mode: bool, token: str, acct_username: str, fromname: str, fromaddr: str, subject: str, templateemailhtmlpath: str, records: Dict):
-    results = []
-    with ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as pool:
+_POOL: Optional[ThreadPoolExecutor] = None
+_POOL_SIZE = 0
+_POOL_LOCK = threading.Lock()
 
-        #debug
-        if test_mode:
-            futures = [pool.submit(send_one, test_mode, token.access_token, acct_username, fromname, fromaddr, subject, templateemailhtmlpath, r) for r in [ records[0], records[1], records[2], records[3], records[4], records[5], records[6] ] ]
-        
-        #production
-        else:
-            futures = [pool.submit(send_one, test_mode, token.access_token, acct_username, fromname, fromaddr, subject, templateemailhtmlpath, r) for r in records]
-        
-            
-        for fut in as_completed(futures):
+
+def _get_pool(max_workers: int = MAX_CONCURRENCY) -> ThreadPoolExecutor:
+    """
+    Sender thread pool shared by every run_mail_merge call in this process, so
+    back-to-back merge batches do not pay thread start-up/teardown each time.
+    Re-created only if a different worker count is requested.
+    """
+    global _POOL, _POOL_SIZE
+    with _POOL_LOCK:
+        if _POOL is None or _POOL_SIZE != max_workers:
+            if _POOL is not None:
+                _POOL.shutdown(wait=True)
+            _POOL = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mailer")
+            _POOL_SIZE = max_workers
+        return _POOL
+
+
+def _shutdown_pool() -> None:
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.shutdown(wait=True)
+            _POOL = None
+
+
+atexit.register(_shutdown_pool)
+
+
+def run_mail_merge( test_mode: bool, token: TokenCache, acct_username: str, fromname: str, fromaddr: str, subject: str, templateemailhtmlpath: str, records: Iterable[Recipient], backend: str = "smtp", max_workers: int = MAX_CONCURRENCY, limiter: Optional[TokenBucket] = None) -> Dict[str, int]:
+    if limiter is None:
+        limiter = _bucket   # process-wide, so back-to-back merges share one RATE_PER_MINUTE budget
+
+    smtp_pool = None
+    # Everything that is identical for every recipient is built once here
+    if backend == "cli":
+        base_cmd = (
+            "build/email-sender",
+            "--from_name", fromname,
+            "--from", fromaddr,
+            "--subject", subject,
+            "--username", acct_username,
+        )
+        deliver = functools.partial(deliver_cli, base_cmd, token.get_access_token)
+    else:
+        smtp_pool = SmtpConnectionPool(acct_username, token.get_access_token)
+        deliver = functools.partial(deliver_smtp, smtp_pool, formataddr((fromname, fromaddr)), subject)
+
+    # Compile/look up the template once; also fails fast before any send if it is missing
+    render = env.get_template(templateemailhtmlpath).render
+
+    # Per-merge arguments bound once; each queued task then only carries its record
+    send = functools.partial(send_one, test_mode, limiter, deliver, render)
+
+    # Only counts are kept; each result is logged and dropped, so memory stays
+    # proportional to the in-flight window, not the recipient list
+    counts = {"sent": 0, "failed": 0}
+    refresh_error: Optional[TokenRefreshError] = None
+
+    def collect(fut):
+        nonlocal refresh_error
+        if fut.cancelled():
+            return
+        try:
             res = fut.result()
-            log.info(json.dumps(res, ensure_ascii=False))
-            results.append(res)
-    return results
+        except TokenRefreshError as e:
+            # Every later send would fail the same way; keep the first error and stop
+            if refresh_error is None:
+                refresh_error = e
+            return
+        log.info(to_json(res))
+        counts["sent" if res["ok"] else "failed"] += 1
+
+    #debug
+    if test_mode:
+        records = itertools.islice(records, 7)
+
+    # Rows are submitted as they are read; cap how many sit in the pool's queue
+    max_in_flight = max_workers * 2
+    pending = set()
+    pool = _get_pool(max_workers)
+    try:
+        for r in records:
+            if len(pending) >= max_in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    collect(fut)
+                if refresh_error is not None:
+                    break
+            pending.add(pool.submit(send, r))
+
+        while pending:
+            if refresh_error is not None:
+                for fut in pending:
+                    fut.cancel()
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                collect(fut)
+    finally:
+        # The pool outlives this call: drop queued sends and let in-flight ones
+        # finish before their SMTP connections are closed.
+        for fut in pending:
+            fut.cancel()
+        wait(pending)
+        if smtp_pool is not None:
+            smtp_pool.close_all()
+
+    if refresh_error is not None:
+        raise refresh_error
+    return counts
 
 def main(argv: Optional[List[str]] = None) -> int:
 
@@ -307,11 +543,26 @@ def main(argv: Optional[List[str]] = None) -> int:
     parser = argparse.ArgumentParser(description="Read a CSV or Excel spreadsheet into dict structures.")
     parser.add_argument("path", help="Path to the CSV or Excel file.")
     parser.add_argument("--tokenfile", help="File containing the OAuth token for authentication to the Microsoft 365 SMTP server. (Obtained by running m365_token_helper.py)")
+    parser.add_argument("--tenant", help="Tenant ID; together with --client-id, lets the token be refreshed automatically during a long merge")
+    parser.add_argument("--client-id", dest="client_id", help="Azure App (client) ID used to refresh the token")
     parser.add_argument("--subject", help="Subject of the e-mail to be sent")
     parser.add_argument("--username", help="Username of the Microsoft 365 account that will be sending the e-mail")
     parser.add_argument("--from_name", help="The name of the sender that will be displayed in the From: field")
     parser.add_argument("--from_addr", help="The From address")
     parser.add_argument("--email_template", help="The E-mail template")
+    parser.add_argument(
+        "--backend",
+        choices=["smtp", "cli"],
+        default="smtp",
+        help="smtp: send in-process over pooled XOAUTH2 connections (default). cli: run build/email-sender per recipient.",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=MAX_CONCURRENCY,
+        help=f"Number of parallel senders, each holding its own SMTP connection (default: {MAX_CONCURRENCY}). "
+             "Throughput is still capped by RATE_PER_MINUTE.",
+    )
 
     group = parser.add_mutually_exclusive_group()
     group.add_argument(
@@ -336,50 +587,54 @@ def main(argv: Optional[List[str]] = None) -> int:
     args = parser.parse_args(argv)
 
     if args.tokenfile is None:
-        log.info("Please supply a valid token file value.", file=sys.stderr)
+        log.error("Please supply a valid token file value.")
         return 2
 
     if args.subject is None:
-        log.info("Please supply a valid e-mail subject value.", file=sys.stderr)
+        log.error("Please supply a valid e-mail subject value.")
         return 2
 
     if args.username is None:
-        log.info("Please supply a valid username value.", file=sys.stderr)
+        log.error("Please supply a valid username value.")
         return 2
 
     if args.from_name is None:
-        log.info("Please supply a valid from_name value.", file=sys.stderr)
+        log.error("Please supply a valid from_name value.")
         return 2
 
     if args.from_addr is None:
-        log.info("Please supply a valid from_addr value.", file=sys.stderr)
+        log.error("Please supply a valid from_addr value.")
         return 2
 
     if args.email_template is None:
-        log.info("Please supply a valid email template value.", file=sys.stderr)
+        log.error("Please supply a valid email template value.")
         return 2
 
     if args.type is None:
-        log.info("Please pass --type {csv,excel} or --excel.", file=sys.stderr)
+        log.error("Please pass --type {csv,excel} or --excel.")
         return 2
 
     if args.type == "excel" and infer_file_type(args.path) == "xls":
-        log.info(".xls is not supported by this script. Save as .xlsx or .csv, or install a library that supports .xls.", file=sys.stderr)
+        log.error(".xls is not supported by this script. Save as .xlsx or .csv, or install a library that supports .xls.")
+        return 2
+
+    if args.concurrency < 1:
+        log.error("--concurrency must be at least 1.")
         return 2
 
     test_mode = args.test
 
     try:
-        with open(f"{args.tokenfile}", "r", encoding="utf-8") as f:
-            token_data = json.load(f)
+        with open(f"{args.tokenfile}", "rb") as f:
+            token_data = from_json(f.read())
     except FileNotFoundError:
-        log.info(f"{args.tokenfile} not found")
+        log.error(f"{args.tokenfile} not found")
         return 2
     except IsADirectoryError:
-        log.info(f"{args.tokenfile} is a directory, not a file")
+        log.error(f"{args.tokenfile} is a directory, not a file")
         return 2
     except PermissionError:
-        log.info(f"no permission to read {args.tokenfile}")
+        log.error(f"no permission to read {args.tokenfile}")
         return 2
 
     
@@ -387,25 +642,44 @@ def main(argv: Optional[List[str]] = None) -> int:
 
     # log.info(f"Token data is {tok}\n")
 
-    has_token_expired = token_expired(tok)
+    can_refresh = bool(args.tenant and args.client_id and tok.refresh_token)
+    if can_refresh:
+        # Same margin as token_expired() so a token that passes the start-up check is never refreshed late
+        token_cache = TokenCache(tok, refresh=make_token_refresher(args.tenant, args.client_id, args.tokenfile), skew_seconds=600)
+        try:
+            token_cache.get_access_token()   # refreshes now if already (nearly) expired
+        except Exception as e:
+            log.error(f"Could not refresh OAuth bearer token: {e}")
+            return 2
+    else:
+        token_cache = TokenCache(tok)
+
+    has_token_expired = token_expired(token_cache.token)
 
     if has_token_expired:
-        log.info("OAuth bearer token has expired. Please refresh it and then retry this script. See README.txt for instructions on how to do this.\n")
+        log.error("OAuth bearer token has expired. Please refresh it and then retry this script (or pass --tenant and --client-id to refresh it automatically). See README.txt for instructions on how to do this.\n")
         return 2
     
 
     try:
         if args.type == "csv":
-            rows = read_csv_to_rows(args.path)
+            rows = iter_csv_rows(args.path)
         elif args.type == "excel":
-            rows = read_excel_to_rows(args.path, sheet=args.sheet)
+            rows = iter_excel_rows(args.path, sheet=args.sheet)
         else:
-            log.info(f"Unsupported file type: {args.type}", file=sys.stderr)
+            log.error(f"Unsupported file type: {args.type}")
             return 2
+        # Rows are read lazily; pull the first one now so an unreadable file fails before any sends
+        first = next(rows, None)
     except Exception as e:
-        log.info(f"Error reading file: {e}", file=sys.stderr)
+        log.error(f"Error reading file: {e}")
         return 1
 
+    if first is None:
+        log.info(f"No recipient rows found in {args.path}")
+        return 0
+    rows = itertools.chain([first], rows)
+
     # for row in rows:
         # log.info( "", row['firstname'], row['lastname'], row['EmailsToUse'] )
 
@@ -414,7 +688,12 @@ def main(argv: Optional[List[str]] = None) -> int:
     # fromaddr = "membership@wafunif.org"
     # templateemailhtmlpath = "testemail2.html.j2"
     
-    run_mail_merge( test_mode, tok, args.username, args.from_name, args.from_addr, args.subject, args.email_template, rows )
+    try:
+        counts = run_mail_merge( test_mode, token_cache, args.username, args.from_name, args.from_addr, args.subject, args.email_template, rows, backend=args.backend, max_workers=args.concurrency )
+    except TokenRefreshError as e:
+        log.error(f"Could not refresh OAuth bearer token; stopped the merge: {e}")
+        return 1
+    log.info(f"Merge finished: {counts['sent']} sent, {counts['failed']} failed.")
 
 
     return 0
@@ -4,21 +4,52 @@ parse_smtp_failures.py
 
 Parse lines like:
   2025-09-15 10:42:13 | INFO | root | {"email": "...", "ok": false, "error": "...\\n..."}
-and emit a list of failures with a concise reason.
+and emit the failures with a concise reason, one record at a time as they are found.
 
 Usage:
-  python parse_smtp_failures.py --in logfile.txt --format json
+  python parse_smtp_failures.py --in logfile.txt --format json         # NDJSON, one compact object per line
+  python parse_smtp_failures.py --in logfile.txt --format json-array   # a single indented JSON array
   python parse_smtp_failures.py --in logfile.txt --format csv
 
-If --in is omitted, reads from stdin.
+If --in is omitted, reads from stdin. The entry count summary goes to stderr.
 """
 
 import argparse
 import csv
 import io
-import json
+import itertools
 import re
 import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from json_codec import JSONDecodeError, from_json, to_json_indented, to_json_line
+
+# Lines handed to a worker process at a time (--jobs > 1 only)
+BATCH_LINES = 10_000
+
+FIELDNAMES = ["timestamp", "email", "firstname", "lastname", "country", "reason"]
+
+# SMTP reply code at the start of a server line, e.g. "535 5.7.3 Authentication unsuccessful"
+_SERVER_RE = re.compile(r"\d{3}[\s-].*")
+
+# Successful sends are most of the log; a substring test is far cheaper than json.loads.
+# Inside JSON string values quotes are escaped, so this can only match the real key.
+_OK_TRUE = ('"ok": true', '"ok":true')
+
+
+def _last_line(text: str, prefix: str):
+    """Rest of the last line starting with `prefix` (e.g. '< '), found with rfind; None if there is none."""
+    i = text.rfind("\n" + prefix)
+    if i != -1:
+        i += 1
+    elif text.startswith(prefix):
+        i = 0
+    else:
+        return None
+    end = text.find("\n", i)
+    return text[i + len(prefix):end if end != -1 else None]
+
 
 # Heuristic: extract a concise reason from a libcurl SMTP transcript
 def summarize_error(err_text: str) -> str:
@@ -29,34 +60,35 @@ def summarize_error(err_text: str) -> str:
     # (json.loads already does this; this is safe regardless)
     text = err_text
 
-    # Split into lines
-    lines = text.splitlines()
+    # Each probe is a C-level reverse scan of the raw text; nothing is split
+    # unless no transcript line is found at all.
 
-    # Prefer the last server reply line (starts with '< ')
-    server_lines = [ln for ln in lines if ln.startswith("< ")]
-    if server_lines:
-        last = server_lines[-1][2:].strip()  # strip "< "
+    # Prefer the last server reply line ('< ')
+    server = _last_line(text, "< ")
+    if server is not None:
+        last = server.strip()
         # If it looks like a 5xx SMTP error, keep it as-is
-        m = re.match(r"(\d{3}[\s-].*)", last)
+        m = _SERVER_RE.match(last)
         if m:
-            return m.group(1)
+            return m.group(0)
         return last
 
-    # Next, prefer the last libcurl status line (starts with '* ')
-    star_lines = [ln for ln in lines if ln.startswith("* ")]
-    if star_lines:
-        return star_lines[-1][2:].strip()
+    # Next, prefer the last libcurl status line ('* ')
+    star = _last_line(text, "* ")
+    if star is not None:
+        return star.strip()
 
-    # Next, the last client command (starts with '> ')
-    client_lines = [ln for ln in lines if ln.startswith("> ")]
-    if client_lines:
+    # Next, the last client command ('> ')
+    client = _last_line(text, "> ")
+    if client is not None:
         # Hide long base64 XOAUTH2 blobs
-        last = client_lines[-1][2:].strip()
+        last = client.strip()
         if last.startswith("dXNlcj0") or "Bearer " in last:
             return "Sent XOAUTH2 blob"
         return last
 
     # Fallback: first line or first 140 chars
+    lines = text.splitlines()
     trimmed = lines[0].strip() if lines else text.strip()
     return (trimmed[:140] + "…") if len(trimmed) > 140 else trimmed
 
@@ -64,22 +96,20 @@ def summarize_error(err_text: str) -> str:
 def parse_log_line(line: str):
     """
     Split 'timestamp | level | logger | {json}' safely.
-    We assume the JSON blob is the part after the final ' | ' sequence.
+    The JSON blob starts at the first ' | {'; lines without one are not results.
     """
-    # Fast path: split into four chunks max
-    parts = line.split(" | ", 3)
-    if len(parts) < 4:
-        return None  # not our format
-    ts, level, logger, json_str = parts[0], parts[1], parts[2], parts[3].strip()
+    i = line.find(" | {")
+    if i < 0:
+        return None  # not our format (e.g. "Sending e-mail to: ...")
 
-    # Some logs can contain trailing spaces or extra text; ensure JSON starts at first '{'
-    start = json_str.find("{")
-    if start > 0:
-        json_str = json_str[start:]
+    parts = line[:i].split(" | ", 2)
+    if len(parts) < 3:
+        return None
+    ts, level, logger = parts
 
     try:
-        payload = json.loads(json_str)
-    except json.JSONDecodeError:
+        payload = from_json(line[i + 3:])
+    except JSONDecodeError:
         return None
 
     return {
@@ -90,10 +120,78 @@ def parse_log_line(line: str):
     }
 
 
+def parse_failure(raw: str):
+    """Failure row for one non-blank log line, or None if it is not a failed send."""
+    if _OK_TRUE[0] in raw or _OK_TRUE[1] in raw:
+        return None  # success; skip without parsing
+    parsed = parse_log_line(raw.rstrip("\n"))
+    if not parsed:
+        return None
+
+    pl = parsed["payload"]
+    ok = pl.get("ok", None)
+    if ok is True:
+        return None  # success; skip
+    # Treat missing 'ok' as failure conservatively
+    if ok is False or ok is None:
+        email = pl.get("email") or pl.get("to") or ""
+        firstname = pl.get("firstname", "")
+        lastname = pl.get("lastname", "")
+        country = pl.get("country", "")
+        error = pl.get("error", "")
+
+        return {
+            "timestamp": parsed["timestamp"],
+            "email": email,
+            "firstname": firstname,
+            "lastname": lastname,
+            "country": country,
+            "reason": summarize_error(error),
+        }
+    return None
+
+
+def parse_batch(lines):
+    """
+    Parse a batch of raw log lines in a worker process (--jobs > 1). Returns
+    (log entry count, failure rows) so the parent can emit them in order.
+    """
+    log_entry_count = 0
+    failures = []
+
+    for raw in lines:
+        if not raw.strip():
+            continue
+        log_entry_count = log_entry_count + 1
+        row = parse_failure(raw)
+        if row is not None:
+            failures.append(row)
+
+    return log_entry_count, failures
+
+
+def _iter_batch_results(fh, jobs: int):
+    """Yield parse_batch results in input order, keeping at most 2 x jobs batches in flight."""
+    batches = iter(lambda: list(itertools.islice(fh, BATCH_LINES)), [])
+
+    # Executor.map would read the whole log up front; submit a bounded window instead
+    with ProcessPoolExecutor(max_workers=jobs) as ex:
+        window = deque()
+        for batch in batches:
+            window.append(ex.submit(parse_batch, batch))
+            if len(window) >= 2 * jobs:
+                yield window.popleft().result()
+        while window:
+            yield window.popleft().result()
+
+
 def main():
     ap = argparse.ArgumentParser(description="Parse SMTP failure entries from logs.")
     ap.add_argument("--in", dest="infile", help="Input log file (default: stdin)")
-    ap.add_argument("--format", choices=["json", "csv"], default="json", help="Output format")
+    ap.add_argument("--format", choices=["json", "json-array", "csv"], default="json",
+                    help="Output format: json (NDJSON, default), json-array, or csv")
+    ap.add_argument("--jobs", type=int, default=1,
+                    help="Worker processes used to parse the log (default: 1, no extra processes)")
     args = ap.parse_args()
 
     if args.infile:
@@ -101,56 +199,61 @@ def main():
     else:
         fh = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8", errors="replace")
 
-    log_entry_count = 0
-
-    failures = []
-    for raw in fh:
-        raw = raw.rstrip("\n")
-        if not raw.strip():
-            continue
-        parsed = parse_log_line(raw)
+    # Failures are written as they are found (per batch with --jobs > 1): memory
+    # stays flat and the output can be piped into another tool before the log is
+    # fully read.
+    out = sys.stdout
+    if args.format == "csv":
+        writer = csv.DictWriter(out, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        emit = writer.writerow
+    elif args.format == "json":
+        # Encoded rows go straight to the binary stream; no intermediate str
+        write = sys.stdout.buffer.write
+        def emit(row):
+            write(to_json_line(row))
+        flush = sys.stdout.buffer.flush
+    else:
+        # Same text json.dump(failures, indent=2) produced, written item by item
+        def emit(row):
+            out.write("[\n  " if failure_count == 0 else ",\n  ")
+            out.write(to_json_indented(row).replace("\n", "\n  "))
 
-        log_entry_count = log_entry_count + 1
+    if args.format != "json":
+        flush = out.flush
+    # A live stream (e.g. tail -f log | ...) gets each row pushed out right away
+    streaming = not args.infile
 
-        if not parsed:
-            continue
+    log_entry_count = 0
+    failure_count = 0
 
-        pl = parsed["payload"]
-        ok = pl.get("ok", None)
-        if ok is True:
-            continue  # success; skip
-        # Treat missing 'ok' as failure conservatively
-        if ok is False or ok is None:
-            email = pl.get("email") or pl.get("to") or ""
-            firstname = pl.get("firstname", "")
-            lastname = pl.get("lastname", "")
-            country = pl.get("country", "")
-            error = pl.get("error", "")
-
-            failures.append({
-                "timestamp": parsed["timestamp"],
-                "email": email,
-                "firstname": firstname,
-                "lastname": lastname,
-                "country": country,
-                "reason": summarize_error(error),
-            })
+    if args.jobs > 1:
+        for entries, failures in _iter_batch_results(fh, args.jobs):
+            log_entry_count += entries
+            for row in failures:
+                emit(row)
+                failure_count += 1
+    else:
+        for raw in fh:
+            if not raw.strip():
+                continue
+            log_entry_count = log_entry_count + 1
+            row = parse_failure(raw)
+            if row is None:
+                continue
+            emit(row)
+            failure_count += 1
+            if streaming:
+                flush()
 
     if args.infile:
         fh.close()
 
-    if args.format == "json":
-        json.dump(failures, sys.stdout, indent=2, ensure_ascii=False)
-        sys.stdout.write("\n")
-    else:
-        writer = csv.DictWriter(sys.stdout,
-                                fieldnames=["timestamp", "email", "firstname", "lastname", "country", "reason"])
-        writer.writeheader()
-        for row in failures:
-            writer.writerow(row)
-
+    if args.format == "json-array":
+        out.write("\n]\n" if failure_count else "[]\n")
 
-    print( f"Parsed {log_entry_count} log entries.\n" )
+    # Summary on stderr so stdout stays valid JSON/CSV
+    print( f"Parsed {log_entry_count} log entries, {failure_count} failures.", file=sys.stderr )
 
 
 if __name__ == "__main__":